@@ -13,7 +13,7 @@ import logging
 from typing import List, Optional, Type, Union
 
 from ray.util.debug import log_once
-from ray.rllib.agents.ppo.ppo_tf_policy import PPOTFPolicy
+from ray.rllib.agents.ppo.ppo_tf_policy import GRAPPLER_OPTIMIZERS, PPOTFPolicy
 from ray.rllib.agents.trainer import Trainer
 from ray.rllib.agents.trainer_config import TrainerConfig
 from ray.rllib.execution.rollout_ops import (
@@ -94,6 +94,12 @@ class PPOConfig(TrainerConfig):
         self.vf_clip_param = 10.0
         self.grad_clip = None
         self.kl_target = 0.01
+        self.kl_estimator = "exact"
+        # Experimental: Set to True to XLA-compile the (tf) loss function.
+        self._enable_xla = False
+        # Experimental: Set to True to enable Grappler's auto mixed precision
+        # and layout/arithmetic/loop optimizations (tf only).
+        self._enable_grappler_optimizations = False
 
         # Override some of TrainerConfig's default values with PPO-specific values.
         self.rollout_fragment_length = 200
@@ -122,6 +128,7 @@ class PPOConfig(TrainerConfig):
         vf_clip_param: Optional[float] = None,
         grad_clip: Optional[float] = None,
         kl_target: Optional[float] = None,
+        kl_estimator: Optional[str] = None,
         **kwargs,
     ) -> "PPOConfig":
         """Sets the training related configuration.
@@ -153,6 +160,13 @@ class PPOConfig(TrainerConfig):
                 increase this.
             grad_clip: If specified, clip the global norm of gradients by this amount.
             kl_target: Target value for KL divergence.
+            kl_estimator: How to compute the KL divergence (between the previous
+                and the current action distribution). One of "exact" (analytic KL
+                of the two distributions), "k1" (unbiased sample estimate
+                `logp_old - logp_new` of the taken actions) or "k3" (unbiased, lower
+                variance sample estimate `(r - 1) - log(r)`, with
+                r = p_new / p_old). The sample-based estimators do not require
+                the previous action distribution to be re-constructed.
 
         Returns:
             This updated TrainerConfig object.
@@ -190,6 +204,45 @@ class PPOConfig(TrainerConfig):
             self.grad_clip = grad_clip
         if kl_target is not None:
             self.kl_target = kl_target
+        if kl_estimator is not None:
+            self.kl_estimator = kl_estimator
+
+        return self
+
+    @override(TrainerConfig)
+    def experimental(
+        self,
+        *,
+        _enable_xla: Optional[bool] = None,
+        _enable_grappler_optimizations: Optional[bool] = None,
+        **kwargs,
+    ) -> "PPOConfig":
+        """Sets the config's experimental settings.
+
+        Args:
+            _enable_xla: Experimental flag.
+                If True, the tf loss function will be XLA-compiled
+                (`jit_compile=True`). Note that XLA compiles a new executable
+                for each distinct batch shape (e.g. for the varying padded
+                B*T shapes of RNN minibatches), so measure whether this
+                actually speeds up training for your particular setup.
+            _enable_grappler_optimizations: Experimental flag.
+                If True, enables Grappler's auto mixed precision (fp16 on GPUs),
+                layout, arithmetic and loop optimizers. For framework=tf, these are
+                set through the `graph_options.rewrite_options` of the (local and
+                remote) workers' `tf_session_args`. For framework=tf2|tfe, they
+                are set as eager context options by each worker's policy.
+
+        Returns:
+            This updated TrainerConfig object.
+        """
+        # Pass kwargs onto super's `experimental()` method.
+        super().experimental(**kwargs)
+
+        if _enable_xla is not None:
+            self._enable_xla = _enable_xla
+        if _enable_grappler_optimizations is not None:
+            self._enable_grappler_optimizations = _enable_grappler_optimizations
 
         return self
 
@@ -295,6 +348,22 @@ class PPOTrainer(Trainer):
         if config["entropy_coeff"] < 0.0:
             raise DeprecationWarning("entropy_coeff must be >= 0.0")
 
+        if config["kl_estimator"] not in ["exact", "k1", "k3"]:
+            raise ValueError(
+                "`kl_estimator` ({}) must be one of 'exact', 'k1', or "
+                "'k3'!".format(config["kl_estimator"])
+            )
+
+        # Opt-in Grappler optimizations (auto mixed precision, etc..) for the
+        # static graph: Set the sessions' RewriterConfig. For the eager
+        # frameworks, the options are set by each worker's policy (see
+        # `ppo_tf_policy.setup_config()`).
+        if config["_enable_grappler_optimizations"] and config["framework"] == "tf":
+            graph_options = config["tf_session_args"].setdefault("graph_options", {})
+            graph_options.setdefault("rewrite_options", {}).update(
+                {option: "ON" for option in GRAPPLER_OPTIMIZERS}
+            )
+
         # SGD minibatch size must be smaller than train_batch_size (b/c
         # we subsample a batch of `sgd_minibatch_size` from the train-batch for
         # each `num_sgd_iter`).
@@ -4,7 +4,8 @@ TensorFlow policy class used for PPO.
 
 import gym
 import logging
-from typing import Dict, List, Optional, Type, Union
+import math
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 
 import ray
 from ray.rllib.evaluation.episode import Episode
@@ -42,6 +43,15 @@ tf1, tf, tfv = try_import_tf()
 
 logger = logging.getLogger(__name__)
 
+# The Grappler optimizers to switch on if
+# `config._enable_grappler_optimizations=True`.
+GRAPPLER_OPTIMIZERS = [
+    "auto_mixed_precision",
+    "layout_optimizer",
+    "arithmetic_optimization",
+    "loop_optimization",
+]
+
 
 def ppo_surrogate_loss(
     policy: Policy,
@@ -62,95 +72,293 @@ def ppo_surrogate_loss(
         Union[TensorType, List[TensorType]]: A single loss tensor or a list
             of loss tensors.
     """
-    if isinstance(model, tf.keras.Model):
-        logits, state, extra_outs = model(train_batch)
-        value_fn_out = extra_outs[SampleBatch.VF_PREDS]
+    logits, state, value_fn_out = _get_forward_fn(model)(model, train_batch)
+
+    # Non-RNN case: Pass an empty seq_lens tensor to keep the compiled loss'
+    # signature fixed.
+    if state:
+        seq_lens = train_batch[SampleBatch.SEQ_LENS]
     else:
-        logits, state = model(train_batch)
-        value_fn_out = model.value_function()
+        seq_lens = tf.zeros([0], dtype=tf.int32)
+
+    loss_inputs = (
+        logits,
+        value_fn_out,
+        train_batch[SampleBatch.ACTIONS],
+        train_batch[Postprocessing.ADVANTAGES],
+        train_batch[Postprocessing.VALUE_TARGETS],
+        train_batch[SampleBatch.ACTION_LOGP],
+        train_batch[SampleBatch.ACTION_DIST_INPUTS],
+        seq_lens,
+    )
+    loss_inputs = tf.nest.map_structure(tf.convert_to_tensor, loss_inputs)
+
+    # Policies not using `setup_mixins` (e.g. ones using this loss function
+    # as part of their own loss): Create the loss constants here.
+    if not hasattr(policy, "_c_vf_clip"):
+        _setup_loss_constants(policy, policy.config)
+
+    # Build the compiled loss function only once (per model and action
+    # distribution class) and reuse it for all subsequent calls.
+    if getattr(policy, "_compiled_loss_fns", None) is None:
+        policy._compiled_loss_fns = {}
+    cache_key = (model, dist_class, bool(state))
+    if cache_key not in policy._compiled_loss_fns:
+        policy._compiled_loss_fns[cache_key] = _build_compiled_loss_fn(
+            policy, model, dist_class, loss_inputs, is_recurrent=bool(state)
+        )
+    compiled_loss_fn = policy._compiled_loss_fns[cache_key]
+
+    # Make sure dtypes match the compiled function's input signature.
+    loss_inputs = tf.nest.map_structure(
+        lambda t, spec: tf.cast(t, spec.dtype),
+        loss_inputs,
+        tuple(compiled_loss_fn.input_signature),
+    )
+    (
+        total_loss,
+        mean_policy_loss,
+        mean_vf_loss,
+        mean_entropy,
+        mean_kl_loss,
+        mask,
+    ) = compiled_loss_fn(*loss_inputs)
+
+    # Store stats in policy for stats_fn.
+    policy._total_loss = total_loss
+    policy._mean_policy_loss = mean_policy_loss
+    policy._mean_vf_loss = mean_vf_loss
+    policy._mean_entropy = mean_entropy
+    # Backward compatibility: Deprecate policy._mean_kl.
+    policy._mean_kl_loss = policy._mean_kl = mean_kl_loss
+    policy._value_fn_out = value_fn_out
+    # RNN case: Store the mask (None otherwise) for re-use in stats_fn.
+    policy._mask = mask
+
+    return total_loss
+
+
+def _keras_forward(
+    model: "tf.keras.Model", train_batch: SampleBatch
+) -> Tuple[TensorType, List[TensorType], TensorType]:
+    """Forward pass through a native keras model (returns VF outs as extra out)."""
+    logits, state, extra_outs = model(train_batch)
+    return logits, state, extra_outs[SampleBatch.VF_PREDS]
+
+
+def _modelv2_forward(
+    model: ModelV2, train_batch: SampleBatch
+) -> Tuple[TensorType, List[TensorType], TensorType]:
+    """Forward pass through a ModelV2 (VF outs via `value_function()`)."""
+    logits, state = model(train_batch)
+    return logits, state, model.value_function()
+
+
+def _get_forward_fn(model: Union[ModelV2, "tf.keras.Model"]) -> Callable:
+    """Returns the forward function (logits, state, vf-outs) for the model."""
+    return _keras_forward if isinstance(model, tf.keras.Model) else _modelv2_forward
+
+
+def _build_compiled_loss_fn(
+    policy: Policy,
+    model: Union[ModelV2, "tf.keras.Model"],
+    dist_class: Type[TFActionDistribution],
+    loss_inputs: Tuple[TensorType, ...],
+    is_recurrent: bool,
+) -> Callable:
+    """Wraps `_compiled_loss` into a `tf.function` with a fixed input signature.
+
+    Only the batch (first) dimension of each input is left variable, such that
+    new batch sizes or sequence lengths do not trigger a re-trace. If
+    `config._enable_xla=True`, the loss' elementwise ops are XLA-compiled
+    (fused).
+
+    Args:
+        policy (Policy): The Policy to calculate the loss for.
+        model (Union[ModelV2, tf.keras.Model]): The Model to calculate
+            the loss for.
+        dist_class (Type[ActionDistribution]: The action distr. class.
+        loss_inputs (Tuple[TensorType, ...]): Example inputs (as passed into
+            `_compiled_loss`) to derive the input signature from.
+        is_recurrent (bool): Whether the model is an RNN (requires masking
+            of the 0-padded time steps).
+
+    Returns:
+        Callable: The compiled loss function.
+    """
+
+    def _batch_spec(t):
+        if t.shape.rank is None:
+            return tf.TensorSpec(None, t.dtype)
+        return tf.TensorSpec([None] + t.shape.as_list()[1:], t.dtype)
+
+    input_signature = list(tf.nest.map_structure(_batch_spec, loss_inputs))
+    # Feed advantages and value targets as float32 to keep the (XLA) graph
+    # stable.
+    input_signature[3] = tf.TensorSpec([None], tf.float32)
+    input_signature[4] = tf.TensorSpec([None], tf.float32)
+    # Use a single concrete function across varying sequence lengths.
+    input_signature[-1] = tf.TensorSpec([None], tf.int32)
+
+    def _loss(*args):
+        return _compiled_loss(policy, model, dist_class, is_recurrent, *args)
+
+    return tf.function(
+        _loss,
+        input_signature=input_signature,
+        jit_compile=policy.config.get("_enable_xla", False),
+    )
 
+
+def _compiled_loss(
+    policy: Policy,
+    model: Union[ModelV2, "tf.keras.Model"],
+    dist_class: Type[TFActionDistribution],
+    is_recurrent: bool,
+    logits: TensorType,
+    value_fn_out: TensorType,
+    actions: TensorType,
+    advantages: TensorType,
+    value_targets: TensorType,
+    old_logp: TensorType,
+    old_dist_inputs: TensorType,
+    seq_lens: TensorType,
+) -> Tuple[TensorType, ...]:
+    """Computes the PPO loss terms from already calculated model outputs.
+
+    Args:
+        policy (Policy): The Policy to calculate the loss for.
+        model (Union[ModelV2, tf.keras.Model]): The Model to calculate
+            the loss for.
+        dist_class (Type[ActionDistribution]: The action distr. class.
+        is_recurrent (bool): Whether the model is an RNN (requires masking
+            of the 0-padded time steps).
+        logits (TensorType): The model's action distribution inputs for the
+            train batch.
+        value_fn_out (TensorType): The model's value function outputs.
+        actions (TensorType): The actions taken (from the train batch).
+        advantages (TensorType): The (GAE) advantages of the taken actions.
+        value_targets (TensorType): The value function targets.
+        old_logp (TensorType): The log-likelihoods of the taken actions under
+            the action distribution used for sampling.
+        old_dist_inputs (TensorType): The action distribution inputs used for
+            sampling.
+        seq_lens (TensorType): The sequence lengths (RNN case), otherwise an
+            empty int32 tensor.
+
+    Returns:
+        Tuple[TensorType, ...]: The total loss, the mean policy loss, the
+            mean vf loss, the mean entropy, the mean KL loss, as well as the
+            (RNN) mask (None for non-RNN models).
+    """
     curr_action_dist = dist_class(logits, model)
 
     # RNN case: Mask away 0-padded chunks at end of time axis.
-    if state:
+    if is_recurrent:
         # Derive max_seq_len from the data itself, not from the seq_lens
         # tensor. This is in case e.g. seq_lens=[2, 3], but the data is still
         # 0-padded up to T=5 (as it's the case for attention nets).
-        B = tf.shape(train_batch[SampleBatch.SEQ_LENS])[0]
+        B = tf.shape(seq_lens)[0]
         max_seq_len = tf.shape(logits)[0] // B
 
-        mask = tf.sequence_mask(train_batch[SampleBatch.SEQ_LENS], max_seq_len)
+        mask = tf.sequence_mask(seq_lens, max_seq_len)
         mask = tf.reshape(mask, [-1])
+        # Use a (static-shape) weighted sum instead of `tf.boolean_mask`,
+        # which would produce dynamic-shape intermediates.
+        mask_f = tf.cast(mask, tf.float32)
+        num_valid = tf.maximum(tf.reduce_sum(mask_f), 1.0)
 
         def reduce_mean_valid(t):
-            return tf.reduce_mean(tf.boolean_mask(t, mask))
+            return tf.reduce_sum(t * tf.expand_dims(mask_f, -1), axis=0) / num_valid
 
     # non-RNN case: No masking.
     else:
         mask = None
-        reduce_mean_valid = tf.reduce_mean
 
-    prev_action_dist = dist_class(train_batch[SampleBatch.ACTION_DIST_INPUTS], model)
+        def reduce_mean_valid(t):
+            return tf.reduce_mean(t, axis=0)
 
-    logp_ratio = tf.exp(
-        curr_action_dist.logp(train_batch[SampleBatch.ACTIONS])
-        - train_batch[SampleBatch.ACTION_LOGP]
-    )
+    logp_diff = curr_action_dist.logp(actions) - old_logp
+    logp_ratio = tf.exp(logp_diff)
 
-    # Only calculate kl loss if necessary (kl-coeff > 0.0).
-    if policy.config["kl_coeff"] > 0.0:
-        action_kl = prev_action_dist.kl(curr_action_dist)
-        mean_kl_loss = reduce_mean_valid(action_kl)
-    else:
-        mean_kl_loss = tf.constant(0.0)
+    # Clip the ratio in log-space (equivalent, as exp is monotonic).
+    clipped_ratio = tf.exp(
+        tf.clip_by_value(logp_diff, policy._c_log_clip_lo, policy._c_log_clip_hi)
+    )
+    # Same as `min(A * ratio, A * clipped_ratio)`, but with a single
+    # multiplication: For A > 0, pick the smaller ratio, otherwise the larger.
+    surrogate_loss = advantages * tf.where(
+        advantages > 0.0,
+        tf.minimum(logp_ratio, clipped_ratio),
+        tf.maximum(logp_ratio, clipped_ratio),
+    )
 
+    # The entropy is always reported (stats), but only needs to be part of
+    # the loss if the entropy coeff is (or may become) > 0.0.
+    use_entropy = (
+        policy.config["entropy_coeff"] != 0.0
+        or policy.config.get("entropy_coeff_schedule") is not None
+    )
     curr_entropy = curr_action_dist.entropy()
-    mean_entropy = reduce_mean_valid(curr_entropy)
 
-    surrogate_loss = tf.minimum(
-        train_batch[Postprocessing.ADVANTAGES] * logp_ratio,
-        train_batch[Postprocessing.ADVANTAGES]
-        * tf.clip_by_value(
-            logp_ratio, 1 - policy.config["clip_param"], 1 + policy.config["clip_param"]
-        ),
-    )
-    mean_policy_loss = reduce_mean_valid(-surrogate_loss)
+    # Collect all per-sample loss terms (and their coefficients), such that
+    # they can be reduced all at once. Only terms that actually contribute
+    # to the total loss get a coefficient (no zero-terms in the graph).
+    loss_terms = {"policy_loss": (-surrogate_loss, 1.0)}
 
     # Compute a value function loss.
     if policy.config["use_critic"]:
-        vf_loss = tf.math.square(
-            value_fn_out - train_batch[Postprocessing.VALUE_TARGETS]
-        )
+        vf_loss = tf.math.square(value_fn_out - value_targets)
         vf_loss_clipped = tf.clip_by_value(
             vf_loss,
             0,
-            policy.config["vf_clip_param"],
+            policy._c_vf_clip,
         )
-        mean_vf_loss = reduce_mean_valid(vf_loss_clipped)
-    # Ignore the value function.
-    else:
-        vf_loss_clipped = mean_vf_loss = tf.constant(0.0)
+        loss_terms["vf_loss"] = (vf_loss_clipped, policy._c_vf_coeff)
 
-    total_loss = reduce_mean_valid(
-        -surrogate_loss
-        + policy.config["vf_loss_coeff"] * vf_loss_clipped
-        - policy.entropy_coeff * curr_entropy
-    )
-    # Add mean_kl_loss (already processed through `reduce_mean_valid`),
-    # if necessary.
+    # Only calculate kl loss if necessary (kl-coeff > 0.0).
     if policy.config["kl_coeff"] > 0.0:
-        total_loss += policy.kl_coeff * mean_kl_loss
-
-    # Store stats in policy for stats_fn.
-    policy._total_loss = total_loss
-    policy._mean_policy_loss = mean_policy_loss
-    policy._mean_vf_loss = mean_vf_loss
-    policy._mean_entropy = mean_entropy
-    # Backward compatibility: Deprecate policy._mean_kl.
-    policy._mean_kl_loss = policy._mean_kl = mean_kl_loss
-    policy._value_fn_out = value_fn_out
-
-    return total_loss
+        kl_estimator = policy.config.get("kl_estimator", "exact")
+        # Sample-based KL(prev || curr) estimators (from the already computed
+        # log-probs of the taken actions): No need to build the prev. action
+        # distribution.
+        if kl_estimator == "k1":
+            action_kl = -logp_diff
+        elif kl_estimator == "k3":
+            action_kl = (logp_ratio - 1.0) - logp_diff
+        else:
+            prev_action_dist = dist_class(old_dist_inputs, model)
+            action_kl = prev_action_dist.kl(curr_action_dist)
+        loss_terms["kl_loss"] = (action_kl, policy.kl_coeff)
+
+    # Entropy (if not part of the loss) is only needed for the stats.
+    if use_entropy:
+        loss_terms["entropy"] = (curr_entropy, -policy.entropy_coeff)
+    terms, coeffs = zip(*loss_terms.values())
+    names = list(loss_terms.keys())
+    if not use_entropy:
+        terms += (curr_entropy,)
+        names.append("entropy")
+
+    # A single (masked) reduction over all K terms: [B, K] -> [K].
+    means = reduce_mean_valid(tf.stack(terms, axis=-1))
+    total_loss = tf.tensordot(means[: len(coeffs)], tf.stack(coeffs), 1)
+    means = dict(zip(names, tf.unstack(means)))
+
+    mean_policy_loss = means["policy_loss"]
+    mean_entropy = means["entropy"]
+    # Ignored value function and/or kl loss -> Report 0.0.
+    mean_vf_loss = means["vf_loss"] if "vf_loss" in means else tf.constant(0.0)
+    mean_kl_loss = means["kl_loss"] if "kl_loss" in means else tf.constant(0.0)
+
+    return (
+        total_loss,
+        mean_policy_loss,
+        mean_vf_loss,
+        mean_entropy,
+        mean_kl_loss,
+        mask,
+    )
 
 
 def kl_and_loss_stats(
@@ -172,7 +380,9 @@ def kl_and_loss_stats(
         "policy_loss": policy._mean_policy_loss,
         "vf_loss": policy._mean_vf_loss,
         "vf_explained_var": explained_variance(
-            train_batch[Postprocessing.VALUE_TARGETS], policy._value_fn_out
+            train_batch[Postprocessing.VALUE_TARGETS],
+            policy._value_fn_out,
+            mask=getattr(policy, "_mask", None),
         ),
         "kl": policy._mean_kl_loss,
         "entropy": policy._mean_entropy,
@@ -221,26 +431,64 @@ def compute_and_clip_gradients(
             tuples.
     """
     # Compute the gradients.
-    variables = policy.model.trainable_variables
-    if isinstance(policy.model, ModelV2):
-        variables = variables()
+    variables = _get_trainable_variables(policy)
     grads_and_vars = optimizer.compute_gradients(loss, variables)
 
     # Clip by global norm, if necessary.
     if policy.config["grad_clip"] is not None:
-        # Defuse inf gradients (due to super large losses).
         grads = [g for (g, v) in grads_and_vars]
-        grads, _ = tf.clip_by_global_norm(grads, policy.config["grad_clip"])
-        # If the global_norm is inf -> All grads will be NaN. Stabilize this
-        # here by setting them to 0.0. This will simply ignore destructive loss
-        # calculations.
-        policy.grads = [tf.where(tf.math.is_nan(g), tf.zeros_like(g), g) for g in grads]
+        policy.grads = _clip_gradients(policy, grads)
         clipped_grads_and_vars = list(zip(policy.grads, variables))
         return clipped_grads_and_vars
     else:
         return grads_and_vars
 
 
+def _get_trainable_variables(policy: Policy) -> List[TensorType]:
+    """Returns the model's trainable variables (cached after the first call)."""
+    variables = getattr(policy, "_trainable_vars_cached", None)
+    if variables is None:
+        variables = policy.model.trainable_variables
+        if isinstance(policy.model, ModelV2):
+            variables = variables()
+        policy._trainable_vars_cached = variables
+    return variables
+
+
+def _clip_gradients(policy: Policy, grads: List[TensorType]) -> List[TensorType]:
+    """Clips the given grads by `config.grad_clip` (global norm) and defuses them.
+
+    Args:
+        policy (Policy): The Policy object that computed the grads.
+        grads (List[TensorType]): The gradients to clip.
+
+    Returns:
+        List[TensorType]: The clipped gradients (all 0.0 if their global norm
+            is not finite).
+    """
+    # Compute the global norm once and scale all grads by it (also handles
+    # `tf.IndexedSlices` grads, e.g. from embedding lookups).
+    grads, global_norm = tf.clip_by_global_norm(grads, policy.config["grad_clip"])
+    # Defuse inf gradients (due to super large losses): If the global_norm
+    # is inf or NaN, stabilize the grads here by setting them to 0.0. This
+    # will simply ignore destructive loss calculations. A single (scalar)
+    # check on the global norm suffices.
+    return tf.cond(
+        tf.math.is_finite(global_norm),
+        lambda: grads,
+        lambda: [_zeros_like_grad(g) for g in grads],
+    )
+
+
+def _zeros_like_grad(grad: TensorType) -> TensorType:
+    """Returns all-0.0 gradients with the same structure as `grad`."""
+    if isinstance(grad, tf.IndexedSlices):
+        return tf.IndexedSlices(
+            tf.zeros_like(grad.values), grad.indices, grad.dense_shape
+        )
+    return tf.zeros_like(grad)
+
+
 def setup_config(
     policy: Policy,
     obs_space: gym.spaces.Space,
@@ -274,6 +522,15 @@ def setup_config(
             "Therefore, remember to tune the value of `vf_loss_coeff`!"
         )
 
+    # Opt-in Grappler optimizations for the eager frameworks (no sessions).
+    # For framework=tf, these are set through the sessions' RewriterConfig
+    # (see `PPOTrainer.validate_config()`).
+    is_eager = config["framework"] in ["tf2", "tfe"]
+    if is_eager and config.get("_enable_grappler_optimizations"):
+        tf.config.optimizer.set_experimental_options(
+            {option: True for option in GRAPPLER_OPTIMIZERS}
+        )
+
 
 def setup_mixins(
     policy: Policy,
@@ -295,6 +552,38 @@ def setup_mixins(
         policy, config["entropy_coeff"], config["entropy_coeff_schedule"]
     )
     LearningRateSchedule.__init__(policy, config["lr"], config["lr_schedule"])
+    _setup_loss_constants(policy, config)
+    # The compiled loss functions (per model and action distribution class)
+    # are built lazily upon the first loss call.
+    policy._compiled_loss_fns = {}
+    # The model's trainable variables are looked up (and cached) upon the
+    # first gradient computation.
+    policy._trainable_vars_cached = None
+
+
+def _setup_loss_constants(policy: Policy, config: TrainerConfigDict) -> None:
+    """Creates (named) tf constants for the config-derived loss parameters.
+
+    Args:
+        policy (Policy): The Policy object.
+        config (TrainerConfigDict): The Policy's config.
+    """
+    # The PPO ratio is clipped in log-space.
+    clip_param = config["clip_param"]
+    policy._c_log_clip_lo = tf.constant(
+        math.log(1 - clip_param) if clip_param < 1.0 else -math.inf,
+        dtype=tf.float32,
+        name="log_clip_lo",
+    )
+    policy._c_log_clip_hi = tf.constant(
+        math.log(1 + clip_param), dtype=tf.float32, name="log_clip_hi"
+    )
+    policy._c_vf_clip = tf.constant(
+        config["vf_clip_param"], dtype=tf.float32, name="vf_clip_param"
+    )
+    policy._c_vf_coeff = tf.constant(
+        config["vf_loss_coeff"], dtype=tf.float32, name="vf_loss_coeff"
+    )
 
 
 @Deprecated(
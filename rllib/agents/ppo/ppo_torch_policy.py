@@ -123,18 +123,25 @@ class PPOTorchPolicy(
             mask = None
             reduce_mean_valid = torch.mean
 
-        prev_action_dist = dist_class(
-            train_batch[SampleBatch.ACTION_DIST_INPUTS], model
-        )
-
-        logp_ratio = torch.exp(
+        logp_diff = (
             curr_action_dist.logp(train_batch[SampleBatch.ACTIONS])
             - train_batch[SampleBatch.ACTION_LOGP]
         )
+        logp_ratio = torch.exp(logp_diff)
 
         # Only calculate kl loss if necessary (kl-coeff > 0.0).
         if self.config["kl_coeff"] > 0.0:
-            action_kl = prev_action_dist.kl(curr_action_dist)
+            kl_estimator = self.config.get("kl_estimator", "exact")
+            # Sample-based KL(prev || curr) estimators.
+            if kl_estimator == "k1":
+                action_kl = -logp_diff
+            elif kl_estimator == "k3":
+                action_kl = (logp_ratio - 1.0) - logp_diff
+            else:
+                prev_action_dist = dist_class(
+                    train_batch[SampleBatch.ACTION_DIST_INPUTS], model
+                )
+                action_kl = prev_action_dist.kl(curr_action_dist)
             mean_kl_loss = reduce_mean_valid(action_kl)
         else:
             mean_kl_loss = torch.tensor(0.0, device=logp_ratio.device)
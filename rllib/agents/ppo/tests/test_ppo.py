@@ -5,6 +5,8 @@ import ray
 from ray.rllib.agents.callbacks import DefaultCallbacks
 import ray.rllib.agents.ppo as ppo
 from ray.rllib.agents.ppo.ppo_tf_policy import (
+    GRAPPLER_OPTIMIZERS,
+    kl_and_loss_stats as kl_and_loss_stats_tf,
     ppo_surrogate_loss as ppo_surrogate_loss_tf,
 )
 from ray.rllib.agents.ppo.ppo_torch_policy import PPOTorchPolicy
@@ -16,6 +18,7 @@ from ray.rllib.models.tf.tf_action_dist import Categorical
 from ray.rllib.models.torch.torch_modelv2 import TorchModelV2
 from ray.rllib.models.torch.torch_action_dist import TorchCategorical
 from ray.rllib.policy.sample_batch import DEFAULT_POLICY_ID, SampleBatch
+from ray.rllib.utils.framework import try_import_tf
 from ray.rllib.utils.metrics.learner_info import LEARNER_INFO, LEARNER_STATS_KEY
 from ray.rllib.utils.numpy import fc
 from ray.rllib.utils.test_utils import (
@@ -25,6 +28,8 @@ from ray.rllib.utils.test_utils import (
     framework_iterator,
 )
 
+tf1, tf, tfv = try_import_tf()
+
 # Fake CartPole episode of n time steps.
 FAKE_BATCH = SampleBatch(
     {
@@ -261,6 +266,160 @@ class TestPPO(unittest.TestCase):
             assert post_std != 0.0, post_std
             trainer.stop()
 
+    def test_ppo_kl_estimators(self):
+        """Tests the sample-based KL estimators (w/o prev. action dist)."""
+        config = (
+            ppo.PPOConfig()
+            .rollouts(
+                num_rollout_workers=0,
+            )
+            .training(
+                gamma=0.99,
+                model=dict(
+                    fcnet_hiddens=[10],
+                    fcnet_activation="linear",
+                    vf_share_layers=True,
+                ),
+            )
+        )
+
+        for kl_estimator in ["k1", "k3"]:
+            config.training(kl_estimator=kl_estimator)
+            for fw, sess in framework_iterator(config, session=True):
+                trainer = ppo.PPOTrainer(config=config, env="CartPole-v0")
+                policy = trainer.get_policy()
+
+                train_batch = compute_gae_for_sample_batch(policy, FAKE_BATCH.copy())
+                if fw == "torch":
+                    train_batch = policy._lazy_tensor_dict(train_batch)
+
+                # Calculate actual PPO loss (and thereby the KL).
+                if fw in ["tf2", "tfe"]:
+                    ppo_surrogate_loss_tf(
+                        policy, policy.model, Categorical, train_batch
+                    )
+                elif fw == "torch":
+                    PPOTorchPolicy.loss(
+                        policy, policy.model, policy.dist_class, train_batch
+                    )
+
+                if sess:
+                    kl = policy.get_session().run(
+                        policy._mean_kl_loss,
+                        feed_dict=policy._get_loss_inputs_dict(
+                            train_batch, shuffle=False
+                        ),
+                    )
+                elif fw == "torch":
+                    kl = policy.model.tower_stats["mean_kl_loss"]
+                else:
+                    kl = policy._mean_kl_loss
+
+                # Calculate expected KL (from the new and old logp of the
+                # taken actions), using numpy.
+                expected_logits, _ = self._expected_model_outs(
+                    policy, fw, train_batch
+                )
+                logp_all = expected_logits - np.log(
+                    np.sum(np.exp(expected_logits), axis=-1, keepdims=True)
+                )
+                actions = FAKE_BATCH[SampleBatch.ACTIONS]
+                logp_new = logp_all[np.arange(len(actions)), actions]
+                logp_diff = logp_new - FAKE_BATCH[SampleBatch.ACTION_LOGP]
+                if kl_estimator == "k1":
+                    # logp_old - logp_new
+                    expected_kl = np.mean(-logp_diff)
+                else:
+                    # (r - 1) - log(r), with r = p_new / p_old
+                    expected_kl = np.mean(np.exp(logp_diff) - 1.0 - logp_diff)
+
+                check(kl, expected_kl, decimals=4)
+                trainer.stop()
+
+    def test_ppo_grad_clip(self):
+        """Tests the (tf) global-norm gradient clipping and inf/NaN defusing."""
+        grad_clip = 0.01
+        config = (
+            ppo.PPOConfig()
+            .rollouts(
+                num_rollout_workers=0,
+            )
+            .training(
+                gamma=0.99,
+                model=dict(
+                    fcnet_hiddens=[10],
+                    fcnet_activation="linear",
+                    vf_share_layers=True,
+                ),
+            )
+        )
+
+        for fw, sess in framework_iterator(
+            config, frameworks=("tf", "tf2", "tfe"), session=True
+        ):
+            config.training(grad_clip=None)
+            trainer_unclipped = ppo.PPOTrainer(config=config, env="CartPole-v0")
+            policy_unclipped = trainer_unclipped.get_policy()
+            config.training(grad_clip=grad_clip)
+            trainer = ppo.PPOTrainer(config=config, env="CartPole-v0")
+            policy = trainer.get_policy()
+            policy.set_weights(policy_unclipped.get_weights())
+
+            train_batch = compute_gae_for_sample_batch(policy, FAKE_BATCH.copy())
+
+            # The clipped grads should be the same as the ones returned by
+            # `tf.clip_by_global_norm`.
+            unclipped_grads, _ = policy_unclipped.compute_gradients(
+                train_batch.copy()
+            )
+            grads, _ = policy.compute_gradients(train_batch.copy())
+            expected_grads, global_norm = tf.clip_by_global_norm(
+                [tf.constant(g) for g in unclipped_grads], grad_clip
+            )
+            if sess:
+                expected_grads, global_norm = sess.run([expected_grads, global_norm])
+            else:
+                expected_grads = [g.numpy() for g in expected_grads]
+                global_norm = global_norm.numpy()
+            # Make sure, clipping actually happened.
+            assert global_norm > grad_clip, global_norm
+            check(grads, expected_grads, decimals=5)
+
+            # A non-finite loss (NaN advantages) should result in all-0.0
+            # gradients.
+            nan_batch = train_batch.copy()
+            nan_batch[Postprocessing.ADVANTAGES][0] = np.nan
+            grads, _ = policy.compute_gradients(nan_batch)
+            for g in grads:
+                check(g, np.zeros_like(g))
+
+            trainer_unclipped.stop()
+            trainer.stop()
+
+    def test_ppo_grappler_optimizations(self):
+        """Tests, whether the opt-in Grappler options are applied."""
+        config = (
+            ppo.PPOConfig()
+            .rollouts(num_rollout_workers=0)
+            .experimental(_enable_grappler_optimizations=True)
+        )
+        for fw in framework_iterator(config, frameworks=("tf", "tf2")):
+            trainer = ppo.PPOTrainer(config=config, env="CartPole-v0")
+            # Static graph: The policy's session should use the options.
+            if fw == "tf":
+                session_config = trainer.get_policy().get_session()._config
+                rewrite_options = session_config.graph_options.rewrite_options
+                for option in GRAPPLER_OPTIMIZERS:
+                    assert (
+                        getattr(rewrite_options, option) == rewrite_options.ON
+                    ), rewrite_options
+            # Eager: The options should be set in the eager context.
+            else:
+                options = tf.config.optimizer.get_experimental_options()
+                for option in GRAPPLER_OPTIMIZERS:
+                    assert options.get(option) is True, options
+            trainer.stop()
+
     def test_ppo_legacy_config(self):
         """Tests, whether the old PPO config dict is still functional."""
         ppo_config = ppo.DEFAULT_CONFIG
@@ -321,27 +480,8 @@ class TestPPO(unittest.TestCase):
                     policy, policy.model, policy.dist_class, train_batch
                 )
 
-            vars = (
-                policy.model.variables()
-                if fw != "torch"
-                else list(policy.model.parameters())
-            )
-            if fw == "tf":
-                vars = policy.get_session().run(vars)
-            expected_shared_out = fc(
-                train_batch[SampleBatch.CUR_OBS],
-                vars[0 if fw != "torch" else 2],
-                vars[1 if fw != "torch" else 3],
-                framework=fw,
-            )
-            expected_logits = fc(
-                expected_shared_out,
-                vars[2 if fw != "torch" else 0],
-                vars[3 if fw != "torch" else 1],
-                framework=fw,
-            )
-            expected_value_outs = fc(
-                expected_shared_out, vars[4], vars[5], framework=fw
+            expected_logits, expected_value_outs = self._expected_model_outs(
+                policy, fw, train_batch
             )
 
             kl, entropy, pg_loss, vf_loss, overall_loss = self._ppo_loss_helper(
@@ -388,6 +528,161 @@ class TestPPO(unittest.TestCase):
                 check(policy._total_loss, overall_loss, decimals=4)
             trainer.stop()
 
+    def test_ppo_loss_function_rnn(self):
+        """Tests the (masked) PPO loss function math on 0-padded RNN batches."""
+        lstm_cell_size = 8
+        config = (
+            ppo.PPOConfig()
+            .rollouts(
+                num_rollout_workers=0,
+            )
+            .training(
+                model=dict(
+                    fcnet_hiddens=[10],
+                    fcnet_activation="linear",
+                    use_lstm=True,
+                    lstm_cell_size=lstm_cell_size,
+                    max_seq_len=20,
+                ),
+            )
+        )
+        # The (not 0-padded) timesteps of all sequences.
+        data = {
+            SampleBatch.OBS: FAKE_BATCH[SampleBatch.OBS],
+            SampleBatch.ACTIONS: FAKE_BATCH[SampleBatch.ACTIONS],
+            SampleBatch.ACTION_LOGP: FAKE_BATCH[SampleBatch.ACTION_LOGP],
+            SampleBatch.ACTION_DIST_INPUTS: FAKE_BATCH[SampleBatch.ACTION_DIST_INPUTS],
+            Postprocessing.ADVANTAGES: np.array([0.5, -0.5, 1.0], dtype=np.float32),
+            Postprocessing.VALUE_TARGETS: np.array(
+                [0.50005, -0.505, 0.5], dtype=np.float32
+            ),
+        }
+
+        def log_softmax(logits):
+            return logits - np.log(np.sum(np.exp(logits), axis=-1, keepdims=True))
+
+        for fw in framework_iterator(config, frameworks=("tf2", "tfe")):
+            trainer = ppo.PPOTrainer(config=config, env="CartPole-v0")
+            policy = trainer.get_policy()
+
+            # Batches with different numbers of sequences (B) and max.
+            # sequence lengths (T).
+            for seq_lens, max_seq_len in [([2, 1], 2), ([1, 1, 1], 3)]:
+                # [B * T] mask of the valid (not 0-padded) timesteps.
+                mask = np.concatenate([np.arange(max_seq_len) < s for s in seq_lens])
+                padded = {}
+                for k, v in data.items():
+                    padded[k] = np.zeros((len(mask),) + v.shape[1:], dtype=v.dtype)
+                    padded[k][mask] = v
+                train_batch = SampleBatch(
+                    dict(
+                        padded,
+                        state_in_0=np.zeros(
+                            [len(seq_lens), lstm_cell_size], dtype=np.float32
+                        ),
+                        state_in_1=np.zeros(
+                            [len(seq_lens), lstm_cell_size], dtype=np.float32
+                        ),
+                        seq_lens=np.array(seq_lens, dtype=np.int32),
+                    ),
+                    _max_seq_len=max_seq_len,
+                    _zero_padded=True,
+                )
+                train_batch = policy._lazy_tensor_dict(train_batch)
+
+                # Calculate actual PPO loss.
+                ppo_surrogate_loss_tf(
+                    policy, policy.model, policy.dist_class, train_batch
+                )
+
+                # Calculate expected (masked) PPO loss terms from the model's
+                # outputs, using numpy.
+                logp_all = log_softmax(policy.model.last_output().numpy())
+                vf_outs = policy._value_fn_out.numpy()
+                prev_logp_all = log_softmax(padded[SampleBatch.ACTION_DIST_INPUTS])
+                actions = padded[SampleBatch.ACTIONS]
+                logp = logp_all[np.arange(len(actions)), actions]
+                rho = np.exp(logp - padded[SampleBatch.ACTION_LOGP])
+                advantages = padded[Postprocessing.ADVANTAGES]
+                pg_loss = np.minimum(
+                    advantages * rho,
+                    advantages
+                    * np.clip(
+                        rho,
+                        1 - policy.config["clip_param"],
+                        1 + policy.config["clip_param"],
+                    ),
+                )
+                vf_loss = np.minimum(
+                    np.power(vf_outs - padded[Postprocessing.VALUE_TARGETS], 2.0),
+                    policy.config["vf_clip_param"],
+                )
+                kl = np.sum(np.exp(prev_logp_all) * (prev_logp_all - logp_all), -1)
+                entropy = -np.sum(np.exp(logp_all) * logp_all, -1)
+
+                def masked_mean(t):
+                    return np.sum(t * mask) / np.sum(mask)
+
+                overall_loss = (
+                    masked_mean(-pg_loss)
+                    + policy.kl_coeff_val * masked_mean(kl)
+                    + policy.config["vf_loss_coeff"] * masked_mean(vf_loss)
+                    - policy.config["entropy_coeff"] * masked_mean(entropy)
+                )
+
+                check(policy._mean_kl_loss, masked_mean(kl))
+                check(policy._mean_entropy, masked_mean(entropy))
+                check(policy._mean_policy_loss, masked_mean(-pg_loss))
+                check(policy._mean_vf_loss, masked_mean(vf_loss), decimals=4)
+                check(policy._total_loss, overall_loss, decimals=4)
+
+                # The vf explained variance should only take the valid
+                # timesteps into account.
+                stats = kl_and_loss_stats_tf(policy, train_batch)
+                value_targets = padded[Postprocessing.VALUE_TARGETS][mask]
+                diff_var = np.var(value_targets - vf_outs[mask])
+                expected_vf_explained_var = max(
+                    -1.0, 1.0 - diff_var / np.var(value_targets)
+                )
+                check(stats["vf_explained_var"], expected_vf_explained_var, decimals=4)
+
+            # All batches (incl. the dummy batch used for the loss
+            # initialization) should have gone through the same concrete
+            # loss function, w/o any re-tracing.
+            compiled_loss_fn = policy._compiled_loss_fns[
+                (policy.model, policy.dist_class, True)
+            ]
+            tracing_count = compiled_loss_fn.experimental_get_tracing_count()
+            assert tracing_count == 1, tracing_count
+            trainer.stop()
+
+    def _expected_model_outs(self, policy, fw, train_batch):
+        """
+        Calculates the expected logits and vf outputs of the (linear,
+        vf-shared) model, given Policy and some batch, using numpy.
+        """
+        vars = (
+            policy.model.variables()
+            if fw != "torch"
+            else list(policy.model.parameters())
+        )
+        if fw == "tf":
+            vars = policy.get_session().run(vars)
+        expected_shared_out = fc(
+            train_batch[SampleBatch.CUR_OBS],
+            vars[0 if fw != "torch" else 2],
+            vars[1 if fw != "torch" else 3],
+            framework=fw,
+        )
+        expected_logits = fc(
+            expected_shared_out,
+            vars[2 if fw != "torch" else 0],
+            vars[3 if fw != "torch" else 1],
+            framework=fw,
+        )
+        expected_value_outs = fc(expected_shared_out, vars[4], vars[5], framework=fw)
+        return expected_logits, expected_value_outs
+
     def _ppo_loss_helper(
         self, policy, model, dist_class, train_batch, logits, vf_outs, sess=None
     ):
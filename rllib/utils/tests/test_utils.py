@@ -8,6 +8,7 @@ from ray.rllib.utils.framework import try_import_tf, try_import_torch
 from ray.rllib.utils.numpy import flatten_inputs_to_1d_tensor as flatten_np
 from ray.rllib.utils.numpy import make_action_immutable
 from ray.rllib.utils.test_utils import check
+from ray.rllib.utils.tf_utils import explained_variance
 from ray.rllib.utils.tf_utils import flatten_inputs_to_1d_tensor as flatten_tf
 from ray.rllib.utils.torch_utils import flatten_inputs_to_1d_tensor as flatten_torch
 
@@ -543,6 +544,16 @@ class TestUtils(unittest.TestCase):
             ),
         )
 
+    def test_explained_variance_w_mask(self):
+        """Tests, whether masked-out entries are ignored by explained_variance."""
+        y = np.array([1.0, 2.0, 3.0, 0.0, 0.0], dtype=np.float32)
+        pred = np.array([1.5, 2.0, 2.5, 5.0, -5.0], dtype=np.float32)
+        mask = np.array([True, True, True, False, False])
+
+        expected = 1.0 - np.var(y[:3] - pred[:3]) / np.var(y[:3])
+        check(explained_variance(y[:3], pred[:3]), expected, decimals=5)
+        check(explained_variance(y, pred, mask=mask), expected, decimals=5)
+
 
 if __name__ == "__main__":
     import pytest
@@ -21,7 +21,9 @@ if TYPE_CHECKING:
 tf1, tf, tfv = try_import_tf()
 
 
-def explained_variance(y: TensorType, pred: TensorType) -> TensorType:
+def explained_variance(
+    y: TensorType, pred: TensorType, mask: Optional[TensorType] = None
+) -> TensorType:
     """Computes the explained variance for a pair of labels and predictions.
 
     The formula used is:
@@ -30,10 +32,21 @@ def explained_variance(y: TensorType, pred: TensorType) -> TensorType:
     Args:
         y: The labels.
         pred: The predictions.
+        mask: An optional (bool) mask of the same shape as `y`. If provided,
+            only the valid (True) entries are taken into account (e.g. to
+            ignore 0-padded timesteps of RNN batches).
 
     Returns:
         The explained variance given a pair of labels and predictions.
     """
+    if mask is not None:
+        weights = tf.cast(mask, y.dtype)
+        _, y_var = tf.nn.weighted_moments(y, axes=[0], frequency_weights=weights)
+        _, diff_var = tf.nn.weighted_moments(
+            y - pred, axes=[0], frequency_weights=weights
+        )
+        return tf.maximum(-1.0, 1 - (diff_var / y_var))
+
     _, y_var = tf.nn.moments(y, axes=[0])
     _, diff_var = tf.nn.moments(y - pred, axes=[0])
     return tf.maximum(-1.0, 1 - (diff_var / y_var))